@@ -1,23 +1,179 @@
-from copy import deepcopy
+from array import array
 from logging import warning
 import time
-from contextlib import contextmanager
-from collections import defaultdict
-import statistics
+from functools import wraps
+import importlib
+import itertools
 import threading
 from threading import local
+import weakref
+
+from timetap._stats import batch_stats, order_by_median
+
+_perf_counter_ns = time.perf_counter_ns
+_SCOPE_POOL_SIZE = 64
+# One report row: name, then runs/total/median/avg/min/max in their colors.
+_ROW_FMT = (
+    "{name:<{w}}"
+    "\033[93m{c:>8d}\033[0m "
+    "\033[92m{t:>12.1f}\033[0m "
+    "\033[96m{m:>12.1f}\033[0m "
+    "\033[94m{a:>12.1f}\033[0m "
+    "\033[95m{mn:>12.1f}\033[0m "
+    "\033[91m{mx:>12.1f}\033[0m\n"
+)
+
+
+class _Scope:
+    """Reusable context manager/decorator for a single timing scope.
+
+    Instances are handed out by TimeTapHelperClass.log and returned to a
+    thread-local free-list on exit, so a `with` block does not allocate a
+    generator and context manager object on every use. A scope is bound to the
+    thread that created it and keeps direct references to that thread's path
+    stack and free-list, so entering and exiting skip the thread-local lookups.
+
+    A scope returned by log() is meant to be entered once. Entering consumes
+    its name, so re-entering it before log() hands it out again raises
+    RuntimeError. After exit the object goes back to the free-list, so a
+    reference kept past the `with` block may alias the next log() result on
+    the same thread; call log() again for every block instead of holding on
+    to a scope.
+    """
+
+    __slots__ = (
+        "name",
+        "verbose",
+        "gpu",
+        "start",
+        "_helper",
+        "_path",
+        "_pool",
+    )
+
+    def __enter__(self) -> "_Scope":
+        name = self.name
+        if name is None:
+            raise RuntimeError(
+                "TimeTap scope already used; call timetap.log() for each block"
+            )
+        self.name = None
+        self._path.append(name)
+        if self.gpu:
+            self._helper._sync_cuda(gpu=True)
+        self.start = _perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        path = self._path
+        helper = self._helper
+        if self.gpu:
+            helper._sync_cuda(gpu=True)
+        elapsed = _perf_counter_ns() - self.start
+        if self.verbose:
+            print(" -> ".join(path), f"{elapsed * 1e-9:.4f} s")
+        helper._update_metrics(elapsed, path)
+        path.pop()
+
+        pool = self._pool
+        if len(pool) < _SCOPE_POOL_SIZE:
+            pool.append(self)
+
+    def __call__(self, func):
+        """
+        Use the scope as a decorator, timing every call of `func`.
+
+        See `_timed` for how each call is recorded.
+        """
+        return _timed(self._helper, self.name, self.verbose, self.gpu, func)
 
-try:
-    import torch
-except ImportError:
-    pass
+
+def _timed(helper, name, verbose, gpu, func):
+    """
+    Wrap `func` so every call is timed under `name`.
+
+    A fresh scope is taken for each call so recursive and concurrent calls are
+    timed independently, and the global enabled flag is checked per call.
+    Calls made outside any other scope skip the scope object and record
+    straight into the calling thread's root shard, so threads never write to
+    a shared timings buffer.
+    """
+    thread_local = helper.thread_local
+    fast = not verbose and not gpu
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        path = getattr(thread_local, "current_path", None)
+        if not fast or path or path is None or not helper.enabled:
+            with helper.log(name, verbose=verbose, gpu=gpu):
+                return func(*args, **kwargs)
+
+        path.append(name)
+        start = _perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = _perf_counter_ns() - start
+            path.pop()
+            # Same as _update_metrics for a one-element path, inlined.
+            local_roots = thread_local.local_roots
+            timings = local_roots.get(name)
+            if timings is None:
+                local_roots[name] = array("q", (elapsed,))
+            else:
+                timings.append(elapsed)
+
+    return wrapper
+
+
+class _NoopScope:
+    """Do-nothing scope returned by log() when timing is disabled.
+
+    The shared `_NOOP` instance (no name) is used for enable=False. While
+    timing is globally disabled, log() returns a named instance instead, so
+    decorating with it still produces a wrapper that checks the global flag on
+    every call and starts timing once timing is re-enabled.
+    """
+
+    __slots__ = ("name", "verbose", "gpu")
+
+    def __init__(self, name=None, verbose=False, gpu=False):
+        self.name = name
+        self.verbose = verbose
+        self.gpu = gpu
+
+    def __enter__(self) -> "_NoopScope":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        return None
+
+    def __call__(self, func):
+        """
+        Decorate `func`; it is left untouched only for enable=False.
+        """
+        if self.name is None:
+            return func
+        return _timed(
+            TimeTapHelperClass(), self.name, self.verbose, self.gpu, func
+        )
+
+
+_NOOP = _NoopScope()
+
+
+class _ShardOwner:
+    """Per-thread sentinel whose collection at thread exit retires the shard."""
+
+    __slots__ = ("__weakref__",)
 
 
 class TimeTapHelperClass:
     """Singleton helper that tracks hierarchical timing metrics across threads.
 
-    Provides thread-local stacks for nested timing contexts, a shared metrics
-    store protected by a lock, and utilities to format and reset collected data.
+    Provides thread-local stacks for nested timing contexts, per-thread metrics
+    shards that are merged on demand, and utilities to format and reset
+    collected data.
     """
 
     _instance = None
@@ -27,8 +183,9 @@ class TimeTapHelperClass:
         Create or return the singleton instance.
 
         Ensures a single shared instance is used across the process, and that
-        thread-local storage, a global lock, the metrics container, and related
-        defaults are initialized exactly once.
+        thread-local storage, the registry of per-thread metrics shards with its
+        merge lock, the aggregate of retired shards, and related defaults are
+        initialized exactly once.
 
         Returns:
             TimeTapHelperClass: the singleton instance.
@@ -36,14 +193,16 @@ class TimeTapHelperClass:
         if cls._instance is None:
             cls._instance = super(TimeTapHelperClass, cls).__new__(cls)
             cls._instance.thread_local = local()
-            cls._instance.lock = threading.Lock()
-            cls._instance.metrics = defaultdict(
-                lambda: {"timings": [], "children": defaultdict(dict)}
-            )
+            cls._instance._merge_lock = threading.Lock()
+            cls._instance._thread_metrics = {}
+            cls._instance._retired = {}
+            cls._instance._shard_tokens = itertools.count()
             cls._instance.max_depth = None
             cls._instance.min_width_func = 15
             cls._instance.max_width_func = 80
             cls._instance.have_printed_gpu_warning = False
+            cls._instance._torch = None
+            cls._instance._cuda_sync = None
             cls._instance.have_printed_enabled_warning = False
             cls._instance.enabled = True
 
@@ -51,96 +210,240 @@ class TimeTapHelperClass:
         return cls._instance
 
     def __init__(self):
-        if not hasattr(self.thread_local, "initialized"):
-            self.thread_local.current_path = []
-            self.thread_local.initialized = True
         """
         Ensure the instance is ready for use.
 
         Calls internal initialization to set up any per-thread data structures
         required before the instance is used by the current thread.
         """
+        if not hasattr(self.thread_local, "initialized"):
+            self._init_thread()
+
+    def _init_thread(self):
+        """
+        Set up the calling thread's path stack, scope pool and metrics shards.
+
+        The shards are registered under a token, and a sentinel stored in the
+        thread-local state retires them (see `_retire_shard`) once the thread
+        exits and its thread-local state is released.
+        """
+        self.thread_local.current_path = []
+        self.thread_local.scope_pool = []
+        self.thread_local.local_roots = {}
+        self.thread_local.local_metrics = {}
+        with self._merge_lock:
+            token = next(self._shard_tokens)
+            self._thread_metrics[token] = (
+                self.thread_local.local_roots,
+                self.thread_local.local_metrics,
+            )
+        owner = self.thread_local.shard_owner = _ShardOwner()
+        weakref.finalize(owner, self._retire_shard, token).atexit = False
+        self.thread_local.initialized = True
+
+    def _retire_shard(self, token):
+        """
+        Fold a finished thread's shards into the retired aggregate.
+
+        Keeps the registry proportional to the number of live threads, so
+        thread-per-task workloads neither leak shards nor slow down merges.
+        """
+        with self._merge_lock:
+            shards = self._thread_metrics.pop(token, None)
+            if shards is None:
+                return
+            local_roots, local_metrics = shards
+            items = [((name,), timings) for name, timings in local_roots.items()]
+            items.extend(local_metrics.items())
+            for key, timings in items:
+                target = self._retired.get(key)
+                if target is None:
+                    # Copied so a merge still reading this shard never sees
+                    # samples that later retirements append here.
+                    self._retired[key] = timings[:]
+                else:
+                    target.extend(timings)
 
     def reset(self):
         """
         Clear all collected metrics and reset configuration.
         """
-        with self.lock:
-            self.metrics.clear()
+        with self._merge_lock:
+            for local_roots, local_metrics in self._thread_metrics.values():
+                local_roots.clear()
+                local_metrics.clear()
+            self._retired.clear()
+
+    def _merge_all(self) -> dict:
+        """
+        Merge every per-thread metrics shard into a fresh flat sample store.
+
+        Only the shard registry and the retired aggregate of exited threads are
+        read under the lock. Each live shard is then snapshotted with atomic
+        copies of its items and timing buffers, so the owning threads keep
+        recording while the merge runs and the result can be rendered without
+        copying it again. The retired aggregate seeds the result, so samples
+        from exited threads are kept. Root-level samples, which each shard keys
+        by bare name, are folded in under their `(name,)` key. Cost is
+        proportional to the number of unique paths plus the number of samples.
+
+        Returns:
+            dict: Mapping of path tuples ('A', 'B', 'C') to their timings.
+        """
+        with self._merge_lock:
+            merged = {key: timings[:] for key, timings in self._retired.items()}
+            shards = list(self._thread_metrics.values())
+        for local_roots, local_metrics in shards:
+            items = [((name,), timings) for name, timings in list(local_roots.items())]
+            items.extend(list(local_metrics.items()))
+            for key, timings in items:
+                target = merged.get(key)
+                if target is None:
+                    merged[key] = timings[:]
+                else:
+                    target.extend(timings)
+        return merged
+
+    def __build_tree(self, samples) -> dict:
+        """
+        Rebuild the hierarchical metrics tree from flat path samples.
 
-    def __sync_cuda(self, gpu=False):
+        Statistics for every path are computed in a single `batch_stats` call
+        and stored on the nodes. Intermediate nodes that have not recorded a
+        timing themselves (for example a scope that is still open while the
+        report is built) get no statistics, so only their children render.
+
+        Parameters:
+            samples (dict): Mapping of path tuples to timings, see `_merge_all`.
+
+        Returns:
+            dict: Nested tree of {"stats": tuple|None, "children": {...}} nodes,
+            where stats is (total, median, minimum, maximum, count).
+        """
+        keys = [key for key, timings in samples.items() if timings]
+        tree = {}
+        for key, stats in zip(keys, batch_stats([samples[key] for key in keys])):
+            current = tree
+            for part in key[:-1]:
+                node = current.get(part)
+                if node is None:
+                    node = current[part] = {"stats": None, "children": {}}
+                current = node["children"]
+            node = current.get(key[-1])
+            if node is None:
+                current[key[-1]] = {"stats": stats, "children": {}}
+            else:
+                node["stats"] = stats
+        return tree
+
+    def _sync_cuda(self, gpu=False):
         if gpu:
-            try:
-                torch.cuda.synchronize()
-            except NameError:
-                if not self.have_printed_gpu_warning:
-                    warning(
-                        "torch not available, cannot synchronize GPU. Have you installed timetap[torch]?"
-                    )
-                self.have_printed_gpu_warning = True
+            cuda_sync = self._cuda_sync
+            if cuda_sync is None:
+                cuda_sync = self._cuda_sync = self.__load_cuda_sync()
+            cuda_sync()
+
+    def __load_cuda_sync(self):
+        """
+        Import torch on first GPU use and return the CUDA synchronize callable.
 
-    def log(self, name: str, enable=True, verbose=False, gpu=False):
+        torch is only imported when a scope is first timed with gpu=True, so
+        CPU-only users never pay its import time or memory. If torch is not
+        installed, a callable that warns once is returned instead.
         """
-        Context manager-style generator that times a code block and records metrics.
+        try:
+            self._torch = importlib.import_module("torch")
+        except ImportError:
+            self._torch = None
+            return self.__warn_no_torch
+        return self._torch.cuda.synchronize
+
+    def __warn_no_torch(self):
+        if not self.have_printed_gpu_warning:
+            warning(
+                "torch not available, cannot synchronize GPU. Have you installed timetap[torch]?"
+            )
+        self.have_printed_gpu_warning = True
 
-        Intended to be used via the provided log context manager wrapper.
+    def log(
+        self, name: str, enable=True, verbose=False, gpu=False
+    ) -> "_Scope | _NoopScope":
+        """
+        Return a context manager that times a code block and records metrics.
+
+        Intended to be used via the provided log wrapper, either in a `with`
+        statement or as a decorator. Scope objects are recycled from a
+        thread-local pool to keep per-call overhead low. When `enable` is False
+        the shared no-op scope is returned; when timing is globally disabled a
+        lightweight named no-op scope is returned, which still decorates
+        functions with a wrapper that honors a later enable(). Either way the
+        block is not added to the nested path, and the check comes before any
+        thread-local access. Threads are set up lazily on their first scope,
+        so callers may hold on to the singleton instead of re-constructing it.
         Behavior:
           - Optionally synchronizes CUDA when gpu=True (if torch is available).
-          - Appends `text` to the current thread-local nested path.
+          - Appends `name` to the current thread-local nested path.
           - Measures elapsed wall-clock time for the enclosed block.
           - Optionally prints a verbose timing line.
           - Updates the shared hierarchical metrics store with the measured time.
 
         Parameters:
-            text (str): A short label for this timing scope; used in the metric tree.
+            name (str): A short label for this timing scope; used in the metric tree.
             enable (bool): If False, the timing is skipped and no metric is recorded.
             verbose (bool): If True, prints a human-readable timing line for the scope.
             gpu (bool): If True and torch is available, synchronizes CUDA before/after measurement.
 
-        Yields:
-            None: designed as a context manager generator (use with `with`).
+        Returns:
+            _Scope | _NoopScope: a context manager (use with `with`) that can also
+            decorate functions.
         """
-        # self.__ensure_initialized()  # Ensure initialization before each use
-        self.thread_local.current_path.append(name)
-
-        if not enable or not self.enabled:
-            yield
+        if not enable:
+            return _NOOP
+        if not self.enabled:
+            return _NoopScope(name, verbose, gpu)
+        try:
+            pool = self.thread_local.scope_pool
+        except AttributeError:
+            # First scope on a thread that never constructed the helper.
+            self._init_thread()
+            pool = self.thread_local.scope_pool
+        if pool:
+            scope = pool.pop()
         else:
-            self.__sync_cuda(gpu=gpu)
-            start = time.perf_counter()
-            yield
-            self.__sync_cuda(gpu=gpu)
-            end = time.perf_counter()
-            if verbose:
-                print(
-                    " -> ".join(self.thread_local.current_path), f"{end - start:.4f} s"
-                )
-
-            self.__update_metrics(end - start)
-
-        self.thread_local.current_path.pop()
-
-    def __update_metrics(self, elapsed):
+            scope = _Scope()
+            scope._helper = self
+            scope._path = self.thread_local.current_path
+            scope._pool = pool
+        scope.name = name
+        scope.verbose = verbose
+        scope.gpu = gpu
+        return scope
+
+    def _update_metrics(self, elapsed, path):
         """
-        Record an elapsed time into the metrics tree for the current thread path.
-
-        Walks the thread-local `current_path` from root to leaf, creating nodes
-        as necessary, and appends the elapsed time only to the final (leaf) node.
-        The operation is performed while holding the instance lock to ensure
-        thread-safe updates.
+        Record an elapsed time for the current thread path.
+
+        The calling thread's `current_path` is used as a flat tuple key, so a
+        sample costs a single hash lookup regardless of nesting depth. Top-level
+        scopes, the most common case, skip building the tuple and are keyed by
+        name in a separate shard, since a str caches its hash and a tuple does
+        not. Timings are integer nanoseconds kept in unboxed `array('q')`
+        buffers (8 bytes per sample). Only the calling thread's own shard is
+        touched, so no lock is needed.
         """
-        with self.lock:
-            current = self.metrics
-            for i, part in enumerate(self.thread_local.current_path):
-                if part not in current:
-                    current[part] = {"timings": [], "children": defaultdict(dict)}
-                if i == (
-                    len(self.thread_local.current_path) - 1
-                ):  # Only add timing to the last function in the stack
-                    current[part]["timings"].append(elapsed)
-                current = current[part]["children"]
-
-    def str_metrics(self, node=None, depth=0, path=[]):
+        if len(path) == 1:
+            key = path[0]
+            local_metrics = self.thread_local.local_roots
+        else:
+            key = tuple(path)
+            local_metrics = self.thread_local.local_metrics
+        timings = local_metrics.get(key)
+        if timings is None:
+            local_metrics[key] = array("q", (elapsed,))
+        else:
+            timings.append(elapsed)
+
+    def str_metrics(self, node=None, depth=0, _out=None):
         """
         Produce a formatted multi-line string representation of collected metrics.
 
@@ -151,25 +454,26 @@ class TimeTapHelperClass:
         Parameters:
             node (dict|None): Internal use. If None, rendering starts at the root.
             depth (int): Internal recursion depth counter.
-            path (list): Internal path accumulator for recursion.
+            _out (list|None): Internal list of output fragments, joined once by
+                the outermost call.
 
         Returns:
-            str: The formatted metrics report.
+            str: The formatted metrics report (None for internal recursive calls).
         """
-        result_str = ""
+        outermost = _out is None
+        if outermost:
+            _out = []
         if node is None:
-            with self.lock:
-                if not self.metrics:
-                    return "No metrics to display."
-                node = deepcopy(self.metrics)
+            samples = self._merge_all()
+            if not samples:
+                return "No metrics to display."
+            node = self.__build_tree(samples)
             if self.max_depth is None:
-                self.max_depth = 0
-                for key in self.__flatten_dict(node):
-                    adder_variable = 0
-                    for k in key.split(" -> "):
-                        self.max_depth = max(len(k) + adder_variable, self.max_depth)
-                        adder_variable += 2
-                        # due to the tree structure adding 2 spaces per depth
+                # due to the tree structure adding 2 spaces per depth
+                self.max_depth = max(
+                    (length + 2 * level for level, length in self.__walk(node)),
+                    default=0,
+                )
                 self.max_depth = min(
                     max(self.max_depth, self.min_width_func), self.max_width_func
                 )
@@ -177,28 +481,23 @@ class TimeTapHelperClass:
             header = f"{'Function':<{self.max_depth}} {'Runs':>8} {'Total(ms)':>12} {'Median(ms)':>12} {'Avg(ms)':>12} {'Min(ms)':>12} {'Max(ms)':>12}\n"
             separator_bold = "\033[1m" + "-" * len(header) + "\033[0m\n"
             separator = "-" * len(header) + "\n"
-            result_str = separator_bold + header + separator
-
-        for idx, (text, data) in enumerate(
-            sorted(
-                node.items(),
-                key=lambda item: (
-                    statistics.median(item[1]["timings"]) if item[1]["timings"] else 0
-                ),
-                reverse=True,
-            )
-        ):
-
-            current_path = path + [text]
-            timings = data["timings"]
-            count = len(timings)
-
-            if count > 0:
-                total_time = sum(timings) * 1000
+            _out.append(separator_bold + header + separator)
+
+        # Siblings are listed by descending median, computed up front.
+        keys = list(node)
+        medians = [node[k]["stats"][1] if node[k]["stats"] else 0 for k in keys]
+        for idx, i in enumerate(order_by_median(medians)):
+            text = keys[i]
+            data = node[text]
+
+            if data["stats"] is not None:
+                total, median, minimum, maximum, count = data["stats"]
+                # Samples are integer nanoseconds; convert to ms for display.
+                total_time = total * 1e-6
                 average_time = total_time / count
-                median_time = statistics.median(timings) * 1000
-                min_time = min(timings) * 1000
-                max_time = max(timings) * 1000
+                median_time = median * 1e-6
+                min_time = minimum * 1e-6
+                max_time = maximum * 1e-6
 
                 indent = ""
                 if depth > 0:
@@ -208,49 +507,50 @@ class TimeTapHelperClass:
                         indent += "├─"
                     indent += "──" * (depth - 1)
 
-                path_str = current_path[-1]
-                func_name = indent + path_str
+                func_name = indent + text
                 if len(func_name) > self.max_depth:
                     func_name = func_name[: self.max_depth - 3] + "..."
 
-                result_str += f"{func_name:<{self.max_depth}}\033[93m{count:>8d}\033[0m \033[92m{total_time:>12.1f}\033[0m \033[96m{median_time:>12.1f}\033[0m \033[94m{average_time:>12.1f}\033[0m \033[95m{min_time:>12.1f}\033[0m \033[91m{max_time:>12.1f}\033[0m\n"
+                _out.append(
+                    _ROW_FMT.format(
+                        name=func_name,
+                        w=self.max_depth,
+                        c=count,
+                        t=total_time,
+                        m=median_time,
+                        a=average_time,
+                        mn=min_time,
+                        mx=max_time,
+                    )
+                )
 
             if data["children"]:
-                result_str += self.str_metrics(
-                    data["children"], depth + 1, current_path
-                )
+                self.str_metrics(data["children"], depth + 1, _out)
 
         if depth == 0:
             self.max_depth = None
 
-        return result_str
+        if outermost:
+            return "".join(_out)
 
-    def __flatten_dict(self, d, parent_key="", sep=" -> ") -> dict:
+    def __walk(self, node, depth=0):
         """
-        Produce a flattened mapping of the hierarchical metrics tree.
+        Yield (depth, name length) for every node of the metrics tree.
 
-        Recursively converts nested `children` structures into a single-level
-        dict mapping joined paths (using `sep`) to their corresponding node data.
-        Useful for computing layout parameters and performing global analyses.
+        A plain depth-first generator, so layout computations iterate the tree
+        without building intermediate containers or joined path strings.
 
         Parameters:
-            d (dict): The hierarchical metrics dictionary (subtree).
-            parent_key (str): Accumulated key prefix for recursion.
-            sep (str): Separator used to join path components.
+            node (dict): The hierarchical metrics dictionary (subtree).
+            depth (int): Depth of `node` below the root.
 
-        Returns:
-            dict: Flattened dictionary mapping 'A -> B -> C' -> node_data.
+        Yields:
+            tuple: (depth, len(name)) per node.
         """
-        items = []
-        for k, v in d.items():
-            new_key = parent_key + sep + k if parent_key else k
-            if "children" in v and v["children"]:
-                items.extend(
-                    self.__flatten_dict(v["children"], new_key, sep=sep).items()
-                )
-            else:
-                items.append((new_key, v))
-        return dict(items)
+        for k, v in node.items():
+            yield depth, len(k)
+            if v["children"]:
+                yield from self.__walk(v["children"], depth + 1)
 
     def set_enabled(self, enabled=False):
         """
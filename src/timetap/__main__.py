@@ -0,0 +1,36 @@
+"""Command line entry point, e.g. `python -m timetap warmup`."""
+
+import argparse
+
+from timetap._stats import warmup
+
+
+def main(argv=None) -> int:
+    """
+    Run a TimeTap maintenance command.
+
+    Commands:
+        warmup: compile the Numba statistics kernels and store them in the
+            on-disk cache, so later processes start with warm kernels.
+
+    Parameters:
+        argv (list|None): Arguments to parse; defaults to sys.argv[1:].
+
+    Returns:
+        int: Process exit code.
+    """
+    parser = argparse.ArgumentParser(prog="python -m timetap")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("warmup", help="compile and cache the Numba statistics kernels")
+    args = parser.parse_args(argv)
+
+    if args.command == "warmup":
+        if warmup():
+            print("TimeTap statistics kernels compiled and cached.")
+        else:
+            print("numba is not installed, nothing to warm up (see timetap[numba]).")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
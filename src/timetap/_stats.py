@@ -0,0 +1,164 @@
+"""Summary statistics over recorded timings.
+
+When numba is installed (timetap[numba]) the statistics are computed by a
+compiled kernel over all samples packed into one int64 array; otherwise they
+fall back to the pure-Python builtins and the statistics module.
+
+The kernels are compiled and cached to disk when this module is imported, so
+the first report does not pay the JIT latency. Set TIMETAP_NO_WARMUP=1 to skip
+this: numpy and numba are then not even imported until the first report, so
+startup stays as cheap as without numba. Run `python -m timetap warmup` to
+populate the cache ahead of time (for example while building an image).
+"""
+
+from array import array
+import os
+import statistics
+import threading
+
+# Below this many siblings the builtin sort beats building a NumPy array.
+_ARGSORT_MIN_SIZE = 64
+
+# Set by _load_kernels(): numpy once imported, and whether numba is usable.
+np = None
+_kernels_available = None
+_load_lock = threading.Lock()
+
+
+# The kernels below are plain Python until _load_kernels() replaces them with
+# their njit-compiled versions.
+def _node_stats(a):
+    n = a.shape[0]
+    total = 0
+    minimum = a[0]
+    maximum = a[0]
+    for x in a:
+        total += x
+        if x < minimum:
+            minimum = x
+        if x > maximum:
+            maximum = x
+    return total, minimum, maximum, n
+
+
+def _median(a):
+    n = a.shape[0]
+    half = n // 2
+    part = np.partition(a, half)
+    upper = part[half]
+    if n % 2:
+        return float(upper)
+    # Everything left of `half` is <= upper, so its max is the lower middle.
+    return (np.max(part[:half]) + upper) / 2.0
+
+
+def _batch_stats(flat, offsets, totals, medians):
+    for i in range(offsets.shape[0] - 1):
+        segment = flat[offsets[i] : offsets[i + 1]]
+        totals[i] = _node_stats(segment)
+        medians[i] = _median(segment)
+
+
+def _load_kernels() -> bool:
+    """
+    Import numpy and numba on first use and compile the kernels lazily.
+
+    The result is cached, so later calls only read a module global.
+
+    Returns:
+        bool: True if the Numba kernels are available.
+    """
+    global np, _node_stats, _median, _batch_stats, _kernels_available
+    if _kernels_available is not None:
+        return _kernels_available
+    with _load_lock:
+        if _kernels_available is None:
+            try:
+                import numpy
+                from numba import njit
+            except ImportError:
+                _kernels_available = False
+            else:
+                np = numpy
+                # Callees first: _batch_stats resolves them when it compiles.
+                _node_stats = njit(cache=True, fastmath=True)(_node_stats)
+                _median = njit(cache=True, fastmath=True)(_median)
+                _batch_stats = njit(cache=True, fastmath=True)(_batch_stats)
+                _kernels_available = True
+    return _kernels_available
+
+
+def batch_stats(buffers) -> list:
+    """
+    Compute summary statistics for many non-empty sequences of timings at once.
+
+    With numba, all buffers are concatenated into one int64 array with segment
+    offsets and reduced by a single kernel call, so the dispatch overhead is
+    paid once per report instead of once per node.
+
+    Parameters:
+        buffers (list[array.array]): The recorded int64 nanosecond samples of
+            each metric node.
+
+    Returns:
+        list[tuple]: (total, median, minimum, maximum, count) per buffer, in the
+        input order and unit.
+    """
+    if not _load_kernels():
+        return [
+            (sum(b), statistics.median(b), min(b), max(b), len(b)) for b in buffers
+        ]
+    n = len(buffers)
+    if n == 0:
+        return []
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in buffers], out=offsets[1:])
+    flat = np.concatenate([np.frombuffer(b, dtype=np.int64) for b in buffers])
+    totals = np.empty((n, 4), dtype=np.int64)
+    medians = np.empty(n, dtype=np.float64)
+    _batch_stats(flat, offsets, totals, medians)
+    return [
+        (total, median, minimum, maximum, count)
+        for (total, minimum, maximum, count), median in zip(
+            totals.tolist(), medians.tolist()
+        )
+    ]
+
+
+def order_by_median(medians) -> list:
+    """
+    Return the indices of `medians` sorted from largest to smallest.
+
+    The sort is stable, so ties keep their original order. Large sibling sets
+    are ordered with NumPy's argsort; small ones stay with the builtin sort,
+    which is faster than converting to an array.
+
+    Parameters:
+        medians (list[float]): One sort key per sibling node.
+
+    Returns:
+        list[int]: Permutation of range(len(medians)).
+    """
+    if np is None or len(medians) < _ARGSORT_MIN_SIZE:
+        return sorted(range(len(medians)), key=medians.__getitem__, reverse=True)
+    return np.argsort(-np.asarray(medians, dtype=np.float64), kind="stable").tolist()
+
+
+def warmup() -> bool:
+    """
+    Compile (or load from the on-disk cache) the Numba statistics kernels.
+
+    The kernels are called on a one-sample buffer of the same type the
+    recorder produces, so the compiled signatures are the ones used by reports.
+
+    Returns:
+        bool: True if the kernels were compiled, False if numba is unavailable.
+    """
+    if not _load_kernels():
+        return False
+    batch_stats([array("q", (0,))])
+    return True
+
+
+if not os.environ.get("TIMETAP_NO_WARMUP"):
+    warmup()
@@ -1,28 +1,36 @@
-from contextlib import contextmanager
 from timetap.TimeTapHelperClass import TimeTapHelperClass
 
+# log() is on the hot path, so it reuses the singleton instead of paying for
+# TimeTapHelperClass() construction on every scope.
+_helper = TimeTapHelperClass()
 
-@contextmanager
-def log(name: str, enable=True, verbose=False, gpu=False) -> None:
+
+def log(name: str, enable=True, verbose=False, gpu=False):
     """
     Public context manager for timing a block of code and recording metrics.
 
     Convenience wrapper that delegates to the singleton TimeTapHelperClass().log.
+    When timing is disabled this costs a single flag check.
 
     Use as:
         with timeTap_log("name"):
             code to measure
 
+    or as a decorator:
+        @timeTap_log(name="name")
+        def func(): ...
+
     Parameters:
         name (str): Label for the timing scope.
         enable (bool): If False, context becomes a no-op.
         verbose (bool): If True, prints an immediate timing line for the scope.
         gpu (bool): If True and torch is available, performs CUDA synchronization.
 
-    Yields:
-        None
+    Returns:
+        A reusable context manager that can also decorate functions; a no-op
+        when timing is disabled.
     """
-    return TimeTapHelperClass().log(
+    return _helper.log(
         name=name,
         enable=enable,
         verbose=verbose,